@@ -1,8 +1,19 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import os
-import pandas as pd
-from markitdown import MarkItDown
-from pdfminer.high_level import extract_text
+import contextlib
+import hashlib
+import math
+import stat
+import tempfile
+import threading
+import time
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from converters import convert_to_text
 
 # --- Configuration ---
 st.set_page_config(
@@ -11,54 +22,246 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize Engine
-md_engine = MarkItDown()
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+# PDF parsing is CPU-bound pure Python, so batches of this size with PDFs
+# in them are parsed in worker processes to get around the GIL. Starting the
+# pool re-imports this script (streamlit plus a bare-mode st.set_page_config),
+# which smaller batches wouldn't earn back.
+PROCESS_POOL_MIN_FILES = 4
+
+@st.cache_resource
+def get_process_pool():
+    """
+    Process pool for PDF parsing. Workers never fork the multi-threaded
+    Streamlit server, and they import their task from converters.py.
+    With forkserver, this script's top level runs once as __mp_main__ in the
+    single-threaded server process, and workers fork from that. With spawn
+    (where forkserver is unavailable), every worker re-runs it at startup.
+    Either way main() stays behind the __main__ guard.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    method = "forkserver" if "forkserver" in methods else "spawn"
+    return ProcessPoolExecutor(
+        max_workers=max(1, (os.cpu_count() or 1) - 1),
+        mp_context=multiprocessing.get_context(method)
+    )
+
+# Converted Markdown is cached on disk, keyed by the SHA-256 of the upload.
+# Bump CACHE_VERSION whenever conversion output changes so old entries miss.
+CACHE_VERSION = 3
+# Per-user default, so another account can't pre-create the directory we use
+CACHE_DIR = Path(
+    os.environ.get("UFC_CACHE_DIR")
+    or Path(tempfile.gettempdir()) / f"ufc-cache-{os.getuid() if hasattr(os, 'getuid') else 'user'}"
+)
+CACHE_MAX_FILES = 256
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
 
 # --- Helper Functions ---
 
+SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+
 def format_size(size_in_bytes):
     """Converts bytes to readable 'KB' or 'MB' strings."""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size_in_bytes < 1024.0:
-            return f"{size_in_bytes:.2f} {unit}"
-        size_in_bytes /= 1024.0
-    return f"{size_in_bytes:.2f} TB"
+    # Unit index straight from the exponent: every 10 bits is one step of 1024
+    idx = min(int(math.log2(max(size_in_bytes, 1))) // 10, len(SIZE_UNITS) - 1)
+    return f"{size_in_bytes / (1 << (idx * 10)):.2f} {SIZE_UNITS[idx]}"
+
+def file_fingerprint(file_bytes, name):
+    """
+    SHA-256 hex digest of the uploaded bytes, salted with the cache version and
+    file extension (the extension decides which parser runs).
+    """
+    extension = os.path.splitext(name)[1].lower()
+    digest = hashlib.sha256(f"v{CACHE_VERSION}:{extension}:".encode("utf-8"))
+    digest.update(file_bytes)
+    return digest.hexdigest()
 
-def convert_file_stream(uploaded_file):
+def cache_dir_ready():
     """
-    Robust converter with PDF fallback logic.
+    Creates CACHE_DIR if needed and checks it is a real directory that only we
+    can access. mkdir(exist_ok=True) accepts whatever is already there, and
+    entries hold users' document text, so a directory owned by someone else or
+    open to group/other is never read from or written to.
     """
-    temp_filename = f"temp_{uploaded_file.name}"
-    
-    with open(temp_filename, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    try:
+        CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        info = os.lstat(CACHE_DIR)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(info.st_mode):
+        return False
+    if not hasattr(os, "getuid"):
+        # No POSIX ownership to check (Windows); rely on the per-user temp dir
+        return True
+    return info.st_uid == os.getuid() and info.st_mode & 0o077 == 0
 
+def read_cached(key):
+    """Returns cached text, or None on a miss, an expired entry or an unsafe cache dir."""
+    if not cache_dir_ready():
+        return None
+    path = CACHE_DIR / f"{key}.md"
     try:
-        # Attempt 1: MarkItDown
+        if time.time() - path.stat().st_mtime > CACHE_TTL_SECONDS:
+            return None
+        return path.read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+def prune_cache():
+    """Drops expired entries, then the oldest ones beyond CACHE_MAX_FILES."""
+    now = time.time()
+    entries = []
+    for path in CACHE_DIR.glob("*.md"):
         try:
-            result = md_engine.convert(temp_filename)
-            if result.text_content.strip():
-                return result.text_content
-        except Exception:
-            pass
-        
-        # Attempt 2: PDF Fallback
-        if temp_filename.lower().endswith(".pdf"):
-            try:
-                raw_text = extract_text(temp_filename)
-                if raw_text.strip():
-                    return f"**Note: Extracted using PDF Fallback**\n\n{raw_text}"
-            except Exception as pdf_err:
-                raise ValueError(f"PDF Fallback failed: {pdf_err}")
-        
-        raise ValueError("Could not extract text content.")
-
-    except Exception as e:
-        raise ValueError(f"Conversion failed: {str(e)}")
-        
+            mtime = path.stat().st_mtime
+        except OSError:
+            continue
+        if now - mtime > CACHE_TTL_SECONDS:
+            path.unlink(missing_ok=True)
+        else:
+            entries.append((mtime, path))
+    entries.sort(reverse=True)
+    for _, path in entries[CACHE_MAX_FILES:]:
+        path.unlink(missing_ok=True)
+
+def write_cached(key, text):
+    """
+    Atomically stores converted text so concurrent workers never see a partial file.
+    Best-effort: a cache that can't be written never fails the conversion.
+    """
+    if not cache_dir_ready():
+        print(f"Skipping cache write for {key}: {CACHE_DIR} is not a private directory")
+        return
+    tmp_path = None
+    try:
+        tmp_path = CACHE_DIR / f"{key}.{uuid.uuid4().hex}.tmp"
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, CACHE_DIR / f"{key}.md")
+        tmp_path = None
+        prune_cache()
+    except OSError as e:
+        print(f"Skipping cache write for {key}: {e}")
     finally:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+        if tmp_path is not None:
+            with contextlib.suppress(OSError):
+                tmp_path.unlink(missing_ok=True)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def convert_bytes(file_bytes, name, _use_processes=False):
+    """
+    Session-wide cached conversion, so widget reruns never reconvert a file.
+    Streamlit keys this on the argument values (the underscored flag is not
+    hashed); the disk cache below it survives process restarts.
+    """
+    key = file_fingerprint(file_bytes, name)
+    text = read_cached(key)
+    if text is None:
+        if _use_processes:
+            try:
+                text = get_process_pool().submit(convert_to_text, file_bytes, name).result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. OOM on a large PDF); start a fresh pool
+                # next time and convert this file on the calling thread
+                print(f"Process pool broken, converting {name} in-thread: {e}")
+                get_process_pool.clear()
+        if text is None:
+            text = convert_to_text(file_bytes, name)
+        write_cached(key, text)
+    # Encode here, once per file: the bytes serve the size stats and downloads
+    return text, text.encode('utf-8', 'replace')
+
+def convert_file_stream(uploaded_file, use_processes=False):
+    """
+    Cached converter. Returns (name, converted_text, converted_bytes, original_size).
+    """
+    text, utf8_bytes = convert_bytes(
+        uploaded_file.getvalue(), uploaded_file.name, _use_processes=use_processes
+    )
+    return uploaded_file.name, text, utf8_bytes, uploaded_file.size
+
+# --- UI Components ---
+
+# st.fragment is stable from Streamlit 1.37; 1.33-1.36 ship it as experimental
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+if fragment is None:
+    fragment = lambda func: func
+
+@fragment
+def render_file(uploaded_file, converted_text, converted_bytes, original_size):
+    """
+    Per-file output. Tab and download clicks rerun only this fragment, not
+    main(), so sibling files aren't revisited. A rendering error is shown in
+    this file's expander instead of stopping the page, on first render or on a
+    fragment rerun.
+    """
+    with st.expander(f"📄 {uploaded_file.name}", expanded=True):
+        try:
+            # 1. Calculate Sizes (UTF-8 bytes come precomputed with the text)
+            converted_size = len(converted_bytes)
+
+            # Calculate reduction percentage
+            if original_size > 0:
+                reduction = ((original_size - converted_size) / original_size) * 100
+            else:
+                reduction = 0
+
+            # 2. Create Tabs (Preview vs Stats)
+            tab_preview, tab_stats = st.tabs(["👁️ Preview", "📊 File Size Comparison"])
+
+            # --- Tab 1: Text Preview ---
+            with tab_preview:
+                st.text_area(
+                    "Content:",
+                    value=converted_text,
+                    height=300,
+                    label_visibility="collapsed",
+                    key=f"preview_{uploaded_file.id}"
+                )
+
+                # Download Buttons
+                base_name = os.path.splitext(uploaded_file.name)[0]
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button(
+                        label="⬇️ Download Markdown (.md)",
+                        data=converted_bytes,
+                        file_name=f"{base_name}_converted.md",
+                        mime="text/markdown",
+                        key=f"dl_md_{uploaded_file.id}"
+                    )
+                with col2:
+                    st.download_button(
+                        label="⬇️ Download Text (.txt)",
+                        data=converted_bytes,
+                        file_name=f"{base_name}_converted.txt",
+                        mime="text/plain",
+                        key=f"dl_txt_{uploaded_file.id}"
+                    )
+
+            # --- Tab 2: File Size Comparison ---
+            with tab_stats:
+                st.markdown("### Efficiency Metrics")
+
+                # Create Data for Table
+                data = {
+                    "Metric": ["Original File Size", "Converted .txt Size"],
+                    "Value": [format_size(original_size), format_size(converted_size)]
+                }
+
+                # Show Table (a plain dict avoids building a DataFrame)
+                st.table(data)
+
+                # Show Highlight Metric
+                if reduction > 0:
+                    st.success(f"🚀 **Text version is {reduction:.1f}% smaller!**")
+                else:
+                    st.info(f"ℹ️ Text version is about the same size ({abs(reduction):.1f}% change).")
+
+        except Exception as e:
+            st.error(f"⚠️ Could not read {uploaded_file.name}. Please check the format.")
+            print(f"Error processing {uploaded_file.name}: {e}")
 
 # --- Main Application ---
 
@@ -79,81 +282,34 @@ def main():
         st.divider()
         st.subheader("📝 Processed Output")
 
-        for uploaded_file in uploaded_files:
-            with st.expander(f"📄 {uploaded_file.name}", expanded=True):
-                
-                with st.spinner(f"Reading {uploaded_file.name}..."):
-                    try:
-                        # 1. Perform Conversion
-                        converted_text = convert_file_stream(uploaded_file)
-                        
-                        # 2. Calculate Sizes
-                        original_size = uploaded_file.size
-                        # Estimate converted size (UTF-8 bytes)
-                        converted_size = len(converted_text.encode('utf-8'))
-                        
-                        # Calculate reduction percentage
-                        if original_size > 0:
-                            reduction = ((original_size - converted_size) / original_size) * 100
-                        else:
-                            reduction = 0
-
-                        # 3. Create Tabs (Preview vs Stats)
-                        tab_preview, tab_stats = st.tabs(["👁️ Preview", "📊 File Size Comparison"])
-
-                        # --- Tab 1: Text Preview ---
-                        with tab_preview:
-                            st.text_area(
-                                "Content:",
-                                value=converted_text,
-                                height=300,
-                                label_visibility="collapsed",
-                                key=f"preview_{uploaded_file.id}"
-                            )
-
-                            # Download Buttons
-                            base_name = os.path.splitext(uploaded_file.name)[0]
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.download_button(
-                                    label="⬇️ Download Markdown (.md)",
-                                    data=converted_text,
-                                    file_name=f"{base_name}_converted.md",
-                                    mime="text/markdown",
-                                    key=f"dl_md_{uploaded_file.id}"
-                                )
-                            with col2:
-                                st.download_button(
-                                    label="⬇️ Download Text (.txt)",
-                                    data=converted_text,
-                                    file_name=f"{base_name}_converted.txt",
-                                    mime="text/plain",
-                                    key=f"dl_txt_{uploaded_file.id}"
-                                )
-
-                        # --- Tab 2: File Size Comparison ---
-                        with tab_stats:
-                            st.markdown("### Efficiency Metrics")
-                            
-                            # Create Data for Table
-                            data = {
-                                "Metric": ["Original File Size", "Converted .txt Size"],
-                                "Value": [format_size(original_size), format_size(converted_size)]
-                            }
-                            df = pd.DataFrame(data)
-
-                            # Show Table
-                            st.table(df)
-
-                            # Show Highlight Metric
-                            if reduction > 0:
-                                st.success(f"🚀 **Text version is {reduction:.1f}% smaller!**")
-                            else:
-                                st.info(f"ℹ️ Text version is about the same size ({abs(reduction):.1f}% change).")
+        # Workers need the script context to share st.cache_data with this session
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(
+            max_workers=MAX_WORKERS,
+            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+        ) as executor:
+            # Pool startup isn't worth it for small batches or batches without PDFs
+            pdf_files = [f for f in uploaded_files if f.name.lower().endswith(".pdf")]
+            use_processes = len(uploaded_files) >= PROCESS_POOL_MIN_FILES and bool(pdf_files)
+            futures = [
+                executor.submit(convert_file_stream, f, use_processes and f in pdf_files)
+                for f in uploaded_files
+            ]
 
+            # Render on the main thread in upload order, each file as soon as
+            # its own conversion is done, so the layout is stable across reruns
+            with st.spinner(f"Reading {len(uploaded_files)} file(s)..."):
+                for uploaded_file, future in zip(uploaded_files, futures):
+                    try:
+                        # Collect Conversion (runs in worker thread)
+                        name, converted_text, converted_bytes, original_size = future.result()
                     except Exception as e:
-                        st.error(f"⚠️ Could not read {uploaded_file.name}. Please check the format.")
+                        with st.expander(f"📄 {uploaded_file.name}", expanded=True):
+                            st.error(f"⚠️ Could not read {uploaded_file.name}. Please check the format.")
                         print(f"Error processing {uploaded_file.name}: {e}")
+                        continue
+
+                    render_file(uploaded_file, converted_text, converted_bytes, original_size)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,132 @@
+"""
+Document-to-Markdown converters.
+
+Kept out of app.py so worker processes can import them: Streamlit runs the app
+script as a synthetic __main__ module that child processes can't resolve.
+Nothing here depends on Streamlit.
+"""
+import os
+import io
+import csv
+import queue
+import tempfile
+from pathlib import Path
+
+# --- Engine Pool ---
+# One pool per process. This module is imported once, unlike app.py which
+# Streamlit re-executes on every rerun, so the pool survives reruns. Each
+# conversion borrows its own instance since MarkItDown isn't guaranteed reentrant.
+_engine_pool = queue.SimpleQueue()
+
+def acquire_engine():
+    try:
+        return _engine_pool.get_nowait()
+    except queue.Empty:
+        # Imported on first use so the UI paints before the heavy parser stack loads
+        from markitdown import MarkItDown
+        return MarkItDown()
+
+def release_engine(engine):
+    _engine_pool.put(engine)
+
+# --- Converters ---
+
+def convert_markitdown(file_bytes, name):
+    """
+    Runs MarkItDown on the upload, in memory when the installed version allows it.
+    """
+    engine = acquire_engine()
+    try:
+        if hasattr(engine, "convert_stream"):
+            # BytesIO over the bytes object shares its buffer, no copy and no disk I/O
+            stream = io.BytesIO(file_bytes)
+            extension = os.path.splitext(name)[1].lower()
+            return engine.convert_stream(stream, file_extension=extension).text_content
+
+        # Older MarkItDown releases require a physical file path. The system temp
+        # dir is RAM-backed on most Linux hosts. The file is closed before
+        # conversion (Windows can't reopen an open temp file by name) and
+        # removed afterwards.
+        with tempfile.NamedTemporaryFile(suffix=Path(name).suffix, delete=False) as tmp:
+            tmp.write(file_bytes)
+        try:
+            return engine.convert(tmp.name).text_content
+        finally:
+            Path(tmp.name).unlink(missing_ok=True)
+    finally:
+        release_engine(engine)
+
+def extract_pdf(file_bytes, name):
+    """
+    pypdf first (several times faster than pdfminer); pdfminer only if it finds nothing.
+    """
+    # Parser imports are deferred to first use to keep Streamlit cold start fast
+    import pypdf
+
+    try:
+        reader = pypdf.PdfReader(io.BytesIO(file_bytes))
+        raw_text = "\n".join(p.extract_text() or "" for p in reader.pages)
+    except Exception:
+        raw_text = ""
+
+    if not raw_text.strip():
+        from pdfminer.high_level import extract_text
+        try:
+            # One full pass: a scanned cover or front matter can precede the
+            # text layer, so no early cutoff after the first pages
+            raw_text = extract_text(io.BytesIO(file_bytes))
+        except Exception as pdf_err:
+            raise ValueError(f"PDF extraction failed: {pdf_err}")
+    return raw_text
+
+def markdown_cell(value):
+    """Escapes a CSV value so it stays inside one Markdown table cell."""
+    value = value.replace("|", "\\|")
+    return value.replace("\r\n", "<br>").replace("\n", "<br>").replace("\r", "<br>")
+
+def extract_csv(file_bytes, name):
+    """Renders a CSV as a Markdown table with the stdlib csv module."""
+    try:
+        content = file_bytes.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # Not UTF-8: MarkItDown detects the encoding
+        return convert_markitdown(file_bytes, name)
+
+    rows = [
+        [markdown_cell(value) for value in row]
+        for row in csv.reader(io.StringIO(content, newline=""))
+    ]
+    if not rows:
+        return ""
+    # Widen to the longest row so extra values are never dropped
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    header, body = rows[0], rows[1:]
+    lines = [
+        "| " + " | ".join(header) + " |",
+        "| " + " | ".join("---" for _ in header) + " |",
+    ]
+    for row in body:
+        lines.append("| " + " | ".join(row) + " |")
+    return "\n".join(lines)
+
+# Known formats go straight to their best parser; everything else uses MarkItDown
+DISPATCH = {
+    ".pdf": extract_pdf,
+    ".csv": extract_csv,
+}
+
+def convert_to_text(file_bytes, name):
+    """
+    Routes the upload to a parser by file extension.
+    """
+    extension = os.path.splitext(name)[1].lower()
+    handler = DISPATCH.get(extension, convert_markitdown)
+    try:
+        text = handler(file_bytes, name)
+    except Exception as e:
+        raise ValueError(f"Conversion failed: {str(e)}")
+
+    if not text.strip():
+        raise ValueError("Conversion failed: Could not extract text content.")
+    return text